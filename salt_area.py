@@ -1,51 +1,137 @@
 import numpy as np
+try:
+    import numba
+except ImportError:
+    # Without Numba the fused expressions are evaluated by numexpr instead
+    numba = None
+    import numexpr as ne
+try:
+    import cupy as cp
+except ImportError:
+    # The GPU path is optional and only used when use_gpu is requested
+    cp = None
 from osgeo import gdal
 import os
 import matplotlib.pyplot as plt
-import re
 import matplotlib.patches as mpatches
 from matplotlib.colors import ListedColormap
+import sys
+from concurrent.futures import as_completed
 
+# Importing water_area also applies its GDAL configuration to this process
+from water_area import AREA_RESULT_DTYPE, create_process_pool, extract_years_from_filenames, get_tile_size, iter_tiles
+from water_area import get_cache_key, load_area_cache, save_area_cache
 
-def extract_year_from_filename(filename):
+# Weight of the (NIR - SWIR) - (Red - SWIR) term, kept as float32 so the
+# kernel does not promote every pixel to float64
+SCI_WEIGHT = np.float32(0.3)
 
-    # This regular expression looks for the first occurrence of '19xx' or '20xx'
-    match = re.search(r'(19|20)\d{2}', filename)
-    if match:
-        return int(match.group(0))
-    else:
-        print(f"  - Warning: Could not find a year in filename: {filename}")
-        return None
+if numba is not None:
+    # Every fast-math flag except 'nnan'/'ninf', so NaN pixels still fail the
+    # threshold comparison instead of being optimised away
+    FASTMATH_FLAGS = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+    @numba.njit(parallel=True, fastmath=FASTMATH_FLAGS, cache=True)
+    def _sci_count(green, red, nir, swir, tmin, tmax):
+        """
+        Counts the pixels whose SCI value lies within [tmin, tmax].
+        The SCI expression, the clamp to 0 and the range test are fused into a
+        single pass over the 2D band tiles, so no temporaries are created.
+        NaN pixels are never counted, since every comparison with NaN is False.
+        """
+        tmin = np.float32(tmin)
+        tmax = np.float32(tmax)
+        count = 0
+        for y in numba.prange(green.shape[0]):
+            for x in range(green.shape[1]):
+                g = green[y, x]
+                r = red[y, x]
+                # Core expression
+                s = (r - g) - SCI_WEIGHT * ((nir[y, x] - swir[y, x]) - (r - swir[y, x]))
+                # Apply max{ ... , 0 } to avoid negatives
+                if s < 0:
+                    s = np.float32(0)
+                # Multiply by green reflectance
+                v = s * g
+                if tmin <= v <= tmax:
+                    count += 1
+        return count
+
+else:
+    def _sci_count(green, red, nir, swir, tmin, tmax):
+        """
+        Counts the pixels whose SCI value lies within [tmin, tmax].
+        numexpr evaluates the SCI expression and the range count as two
+        multi-threaded, block-wise passes with one float32 temporary.
+        """
+        # SCI = max{(R - G) - 0.3 * ((NIR - SWIR) - (R - SWIR)), 0} * G
+        core = "((r - g) - w * ((n - sw) - (r - sw)))"
+        sci = ne.evaluate(
+            f"where({core} < 0, 0, {core}) * g",
+            local_dict={'g': green, 'r': red, 'n': nir, 'sw': swir, 'w': SCI_WEIGHT},
+        )
+        return int(ne.evaluate(
+            "sum(where((sci >= tmin) & (sci <= tmax), 1, 0))",
+            local_dict={'sci': sci, 'tmin': np.float32(tmin), 'tmax': np.float32(tmax)},
+        ))
+
+if cp is not None:
+    # Same computation as _sci_count as a single CUDA map-reduce kernel, so
+    # no per-pixel SCI or mask array is materialised on the device either
+    _sci_count_kernel = cp.ReductionKernel(
+        'float32 g, float32 r, float32 n, float32 s, float32 w, float32 tmin, float32 tmax',
+        'int64 count',
+        'sci_hit(g, r, n, s, w, tmin, tmax)',
+        'a + b',
+        'count = a',
+        '0',
+        'sci_count',
+        preamble='''
+        __device__ long long sci_hit(float g, float r, float n, float s, float w, float tmin, float tmax) {
+            float sci = (r - g) - w * ((n - s) - (r - s));
+            if (sci < 0) sci = 0;
+            sci *= g;
+            return sci >= tmin && sci <= tmax;
+        }
+        ''',
+    )
 
-def calculate_salt_area(filepath, green_band_num, nir_band_num, red_band_num, swir_band_num, threshold_min, threshold_max, pixel_area):
+    def _sci_count_gpu(green, red, nir, swir, tmin, tmax):
+        """
+        GPU version of _sci_count: copies the band tiles to the device and
+        counts the matching pixels with one fused CuPy reduction kernel.
+        """
+        return int(_sci_count_kernel(
+            cp.asarray(green), cp.asarray(red), cp.asarray(nir), cp.asarray(swir), SCI_WEIGHT,
+            np.float32(tmin), np.float32(tmax),
+        ))
+
+def calculate_salt_area(filepath, green_band_num, nir_band_num, red_band_num, swir_band_num, threshold_min, threshold_max, pixel_area, use_gpu=False):
     """
     Calculates the total area of water in a TIF file.
     This version takes a known pixel area as input.
+    Pixels are counted on the GPU with CuPy when use_gpu is True.
     """
-    dataset = gdal.Open(filepath)
-    if dataset is None:
-        return None
+    sci_count = _sci_count_gpu if use_gpu else _sci_count
 
     try:
-        green_array = dataset.GetRasterBand(green_band_num).ReadAsArray().astype(np.float32)
-        nir_array = dataset.GetRasterBand(nir_band_num).ReadAsArray().astype(np.float32)
-        red_array = dataset.GetRasterBand(red_band_num).ReadAsArray().astype(np.float32)
-        swir_array = dataset.GetRasterBand(swir_band_num).ReadAsArray().astype(np.float32)
-        np.seterr(divide='ignore', invalid='ignore')
-# Core expression
-        sci_expr = (red_array - green_array) - 0.3 * ((nir_array - swir_array) - (red_array - swir_array))
-
-        
-        # Apply max{ ... , 0 } to avoid negatives
-        sci_expr = np.maximum(sci_expr, 0)
-        # Multiply by blue reflectance
-        SCI = sci_expr * green_array
-        # Replace NaN values with 0
-        SCI[np.isnan(SCI)] = 0
-
-        salt_mask = (SCI >= threshold_min) & (SCI <= threshold_max)
-        salt_pixel_count = np.sum(salt_mask)
-        
+        dataset = gdal.Open(filepath)
+
+        band_list = [green_band_num, nir_band_num, red_band_num, swir_band_num]
+        green_band = dataset.GetRasterBand(green_band_num)
+
+        # Walk the image tile by tile so the four band tiles stay in cache
+        # while the SCI kernel runs. Each tile is read with a single call into
+        # one contiguous float32 (band, row, column) buffer that is reused
+        tile_x, tile_y = get_tile_size(green_band)
+        buffers = np.empty((len(band_list), tile_y, tile_x), dtype=np.float32)
+        salt_pixel_count = 0
+        for xoff, yoff, xsize, ysize in iter_tiles(green_band, tile_x, tile_y):
+            tile = buffers[:, :ysize, :xsize]
+            dataset.ReadAsArray(xoff, yoff, xsize, ysize, buf_obj=tile, band_list=band_list)
+            green_array, nir_array, red_array, swir_array = tile
+            salt_pixel_count += sci_count(green_array, red_array, nir_array, swir_array, threshold_min, threshold_max)
+
         total_salt_area = salt_pixel_count * pixel_area
         return total_salt_area
     except Exception as e:
@@ -59,20 +145,21 @@ def plot_area_over_time(time_series_data):
     Creates and displays a line plot of water area over time.
     
     Args:
-        time_series_data (list): A list of tuples, where each tuple is (year, area_in_sq_meters).
+        time_series_data (numpy.ndarray): A structured array of AREA_RESULT_DTYPE
+            records, each holding a year and an area in square meters.
     """
-    if not time_series_data:
+    if len(time_series_data) == 0:
         print("No data to plot.")
         return
 
     # Sort the data by year to ensure the line plot is correct
-    time_series_data.sort()
+    time_series_data.sort(order='year')
     
-    # Unpack the sorted data into separate lists for plotting
-    years, areas_sq_meters = zip(*time_series_data)
+    # Take the sorted columns for plotting
+    years, areas_sq_meters = time_series_data['year'], time_series_data['area']
     
     # Convert area to square kilometers for better readability on the plot
-    areas_sq_km = [area / 1_000_000 for area in areas_sq_meters]
+    areas_sq_km = np.asarray(areas_sq_meters, dtype=np.float64) * 1e-6
     
     # --- Create the Plot ---
     plt.figure(figsize=(12, 7))
@@ -120,10 +207,19 @@ if __name__ == '__main__':
     SCI_THRESHOLD_MAX = 0.15
     
     PIXEL_AREA_SQ_METERS = 900.0
+
+    # Count pixels on the GPU with CuPy instead of the CPU kernels
+    USE_GPU = False
+    if USE_GPU and cp is None:
+        print("Error: USE_GPU is set but CuPy is not installed.")
+        sys.exit(1)
+
+    # Results are reused until any of these parameters changes
+    CACHE_FILENAME = '.salt_area_cache.json'
+    CACHE_PARAMETERS = (GREEN_BAND_IN_FILE, NIR_BAND_IN_FILE, RED_BAND_IN_FILE, SWIR_BAND_IN_FILE,
+                        SCI_THRESHOLD_MIN, SCI_THRESHOLD_MAX, PIXEL_AREA_SQ_METERS)
     
     # --- Main Execution ---
-    # List to store our results as (year, area) tuples
-    time_series_results = []
     
     print(f"Scanning for .tif files in folder: '{image_folder}'...")
     
@@ -131,36 +227,68 @@ if __name__ == '__main__':
     if not os.path.isdir(image_folder):
         print(f"Error: Folder '{image_folder}' not found. Please create it and add your images.")
     else:
-        # Loop through every file in the specified folder
-        for filename in sorted(os.listdir(image_folder)):
-            if filename.lower().endswith(('.tif', '.tiff')):
-                print(f"\nProcessing file: {filename}...")
-                
-                # Construct the full path to the image
-                full_path = os.path.join(image_folder, filename)
-                
-                # Extract the year from the filename
-                year = extract_year_from_filename(filename)
-                
-                if year:
-                    # Calculate the water area for the current image
-                    area = calculate_salt_area(
-                        filepath=full_path,
-                        green_band_num=GREEN_BAND_IN_FILE,
-                        nir_band_num=NIR_BAND_IN_FILE,
-                        red_band_num=RED_BAND_IN_FILE,
-                        swir_band_num=SWIR_BAND_IN_FILE,
-                        threshold_min=SCI_THRESHOLD_MIN,
-                        threshold_max=SCI_THRESHOLD_MAX,
-                        pixel_area=PIXEL_AREA_SQ_METERS
-                    )
-                    
-                    if area is not None:
-                        print(f"  - Found Year: {year}, Calculated Salt Area: {area / 1_000_000:,.2f} sq km")
-                        # Add the result to our list
-                        time_series_results.append((year, area))
+        # List the TIF files in the folder
+        entries = [entry for entry in sorted(os.scandir(image_folder), key=lambda entry: entry.name)
+                   if entry.name.lower().endswith(('.tif', '.tiff'))]
+
+        # Extract the years from all filenames at once and collect the
+        # (year, path, cache key) of every file with a year in its name
+        years = extract_years_from_filenames([entry.name for entry in entries])
+        jobs = [(year, entry.path, get_cache_key(entry)) for year, entry in zip(years, entries) if year]
+
+        cache_path = os.path.join(image_folder, CACHE_FILENAME)
+        area_cache = load_area_cache(cache_path, CACHE_PARAMETERS)
+        updated_cache = {}
+
+        # Store our results as (year, area) records, one slot per file
+        time_series_results = np.empty(len(jobs), dtype=AREA_RESULT_DTYPE)
+        result_count = 0
+
+        # Take the results of unchanged files from the cache
+        for year, full_path, cache_key in jobs:
+            if cache_key in area_cache:
+                area = area_cache[cache_key]
+                print(f"\nUsing cached result for file: {os.path.basename(full_path)}")
+                print(f"  - Found Year: {year}, Calculated Salt Area: {area / 1_000_000:,.2f} sq km")
+                # Add the result to our array
+                time_series_results[result_count] = (year, area)
+                result_count += 1
+                updated_cache[cache_key] = area
+
+        # Process the uncached files in parallel, one file per task
+        pending_jobs = [job for job in jobs if job[2] not in area_cache]
+        with create_process_pool(len(pending_jobs)) as executor:
+            futures = {}
+            for year, full_path, cache_key in pending_jobs:
+                future = executor.submit(
+                    calculate_salt_area,
+                    filepath=full_path,
+                    green_band_num=GREEN_BAND_IN_FILE,
+                    nir_band_num=NIR_BAND_IN_FILE,
+                    red_band_num=RED_BAND_IN_FILE,
+                    swir_band_num=SWIR_BAND_IN_FILE,
+                    threshold_min=SCI_THRESHOLD_MIN,
+                    threshold_max=SCI_THRESHOLD_MAX,
+                    pixel_area=PIXEL_AREA_SQ_METERS,
+                    use_gpu=USE_GPU,
+                )
+                futures[future] = (year, full_path, cache_key)
+
+            for future in as_completed(futures):
+                year, full_path, cache_key = futures[future]
+                area = future.result()
+                print(f"\nProcessed file: {os.path.basename(full_path)}")
+
+                if area is not None:
+                    print(f"  - Found Year: {year}, Calculated Salt Area: {area / 1_000_000:,.2f} sq km")
+                    # Add the result to our array
+                    time_series_results[result_count] = (year, area)
+                    result_count += 1
+                    updated_cache[cache_key] = area
+
+        save_area_cache(cache_path, CACHE_PARAMETERS, updated_cache)
 
         # --- After processing all files, generate the plot ---
         print("\n--- All files processed. Generating plot... ---")
 
-        plot_area_over_time(time_series_results)
+        plot_area_over_time(time_series_results[:result_count])
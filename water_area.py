@@ -1,11 +1,34 @@
 import numpy as np
-from osgeo import gdal
+try:
+    import numba
+except ImportError:
+    # Without Numba the fused expressions are evaluated by numexpr instead
+    numba = None
+    import numexpr as ne
+try:
+    import cupy as cp
+except ImportError:
+    # The GPU path is optional and only used when use_gpu is requested
+    cp = None
+try:
+    import hyperscan
+except ImportError:
+    # Filenames are then matched one at a time with YEAR_PATTERN
+    hyperscan = None
+from osgeo import gdal, gdal_array
 import os
 import matplotlib.pyplot as plt
 import re
+import bisect
+import itertools
 import matplotlib.patches as mpatches
 from matplotlib.colors import ListedColormap
 import sys
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Matches the first occurrence of '19xx' or '20xx', compiled once per process
+YEAR_PATTERN = re.compile(r'(19|20)\d{2}')
 
 def extract_year_from_filename(filename):
     """
@@ -17,36 +40,215 @@ def extract_year_from_filename(filename):
     Returns:
         int: The extracted year, or None if no year is found.
     """
-    # This regular expression looks for the first occurrence of '19xx' or '20xx'
-    match = re.search(r'(19|20)\d{2}', filename)
+    match = YEAR_PATTERN.search(filename)
     if match:
         return int(match.group(0))
     else:
         print(f"  - Warning: Could not find a year in filename: {filename}")
         return None
 
-def calculate_water_area(filepath, green_band_num, nir_band_num, threshold, pixel_area):
+if hyperscan is not None:
+    # The same pattern compiled once into a Hyperscan database, reporting the
+    # start of each match so the year can be sliced out
+    YEAR_DATABASE = hyperscan.Database()
+    YEAR_DATABASE.compile(expressions=[YEAR_PATTERN.pattern.encode()], ids=[0],
+                          flags=[hyperscan.HS_FLAG_SOM_LEFTMOST])
+
+def extract_years_from_filenames(filenames):
+    """
+    Extracts the year of every filename in a list, like
+    extract_year_from_filename. When hyperscan is installed, all names are
+    scanned in one call instead of one regular expression search per name.
+
+    Args:
+        filenames (list): The input filenames.
+
+    Returns:
+        list: The extracted year of each filename, or None where no year is found.
+    """
+    if hyperscan is None or not filenames:
+        return [extract_year_from_filename(filename) for filename in filenames]
+
+    # Join the names with NUL, which cannot appear in a filename, and keep the
+    # offset where each one starts to map a match back to its filename
+    encoded = [os.fsencode(filename) for filename in filenames]
+    starts = list(itertools.accumulate((len(name) + 1 for name in encoded[:-1]), initial=0))
+    data = b'\0'.join(encoded)
+    years = [None] * len(filenames)
+
+    def on_match(pattern_id, start, end, flags, context):
+        index = bisect.bisect_right(starts, start) - 1
+        # Matches are reported by increasing offset, so keep the first one
+        if years[index] is None:
+            years[index] = int(data[start:end])
+
+    YEAR_DATABASE.scan(data, match_event_handler=on_match)
+
+    for filename, year in zip(filenames, years):
+        if year is None:
+            print(f"  - Warning: Could not find a year in filename: {filename}")
+    return years
+
+# Upper bound, in megabytes, of GDAL's block cache in each process. Tiles are
+# block aligned and every block is decoded once, so a bounded cache keeps the
+# peak memory of each worker independent of the image size
+GDAL_CACHE_MAX_MB = 512
+gdal.SetConfigOption('GDAL_CACHEMAX', str(GDAL_CACHE_MAX_MB))
+
+# Raise Python exceptions on GDAL errors instead of returning None, and let
+# GDAL decompress blocks on all cores (init_worker narrows this per process)
+gdal.UseExceptions()
+gdal.SetConfigOption('GDAL_NUM_THREADS', 'ALL_CPUS')
+
+# Smallest tile edge in pixels, so striped rasters (blocks one row high) are
+# not read a single line at a time
+MIN_TILE_SIZE = 256
+
+def get_tile_size(band):
+    """
+    Returns the (width, height) of the tiles used to walk a raster band.
+    Tiles are whole multiples of the band's native block size, so every read
+    decodes complete blocks, and never larger than the band itself.
+    """
+    block_x, block_y = band.GetBlockSize()
+    tile_x = max(block_x, MIN_TILE_SIZE // block_x * block_x)
+    tile_y = max(block_y, MIN_TILE_SIZE // block_y * block_y)
+    return min(tile_x, band.XSize), min(tile_y, band.YSize)
+
+def iter_tiles(band, tile_x, tile_y):
+    """
+    Yields the (xoff, yoff, xsize, ysize) windows covering a raster band,
+    clipped at its right and bottom edges.
+    """
+    for yoff in range(0, band.YSize, tile_y):
+        ysize = min(tile_y, band.YSize - yoff)
+        for xoff in range(0, band.XSize, tile_x):
+            yield xoff, yoff, min(tile_x, band.XSize - xoff), ysize
+
+if numba is not None:
+    # Every fast-math flag except 'nnan'/'ninf', so NaN pixels still fail the
+    # threshold comparison instead of being optimised away
+    FASTMATH_FLAGS = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+    @numba.njit(parallel=True, fastmath=FASTMATH_FLAGS, cache=True)
+    def _ndwi_count(green, nir, threshold):
+        """
+        Counts the pixels whose NDWI, (green - nir) / (green + nir), is above
+        the threshold. The test is evaluated without a division, as
+        (green - nir) > threshold * (green + nir) with the inequality flipped for
+        a negative denominator, in one pass over the 2D band tiles.
+        The bands may use any numeric dtype and are widened to float32 pixel by
+        pixel; pixels with a zero denominator or NaN are not counted.
+        """
+        threshold = np.float32(threshold)
+        count = 0
+        for y in numba.prange(green.shape[0]):
+            for x in range(green.shape[1]):
+                g = np.float32(green[y, x])
+                n = np.float32(nir[y, x])
+                numerator = g - n
+                denominator = g + n
+                limit = threshold * denominator
+                if (denominator > 0 and numerator > limit) or (denominator < 0 and numerator < limit):
+                    count += 1
+        return count
+
+else:
+    def _ndwi_count(green, nir, threshold):
+        """
+        Counts the pixels whose NDWI, (green - nir) / (green + nir), is above
+        the threshold, using the same division-free test as the Numba kernel.
+        numexpr has no 16-bit integer types, so the bands are cast to float32.
+        """
+        return int(ne.evaluate(
+            "sum(where(((g + n > 0) & (g - n > t * (g + n))) | ((g + n < 0) & (g - n < t * (g + n))), 1, 0))",
+            local_dict={'g': green.astype(np.float32, copy=False), 'n': nir.astype(np.float32, copy=False),
+                        't': np.float32(threshold)},
+        ))
+
+if cp is not None:
+    # Same division-free test as _ndwi_count as a single CUDA map-reduce
+    # kernel; the bands keep their native dtype and are widened on the device
+    _ndwi_count_kernel = cp.ReductionKernel(
+        'T g, T n, float32 t',
+        'int64 count',
+        'ndwi_hit((float)g, (float)n, t)',
+        'a + b',
+        'count = a',
+        '0',
+        'ndwi_count',
+        preamble='''
+        __device__ long long ndwi_hit(float g, float n, float t) {
+            float numerator = g - n;
+            float denominator = g + n;
+            float limit = t * denominator;
+            return (denominator > 0 && numerator > limit) || (denominator < 0 && numerator < limit);
+        }
+        ''',
+    )
+
+    def _ndwi_count_gpu(green, nir, threshold):
+        """
+        GPU version of _ndwi_count: copies the band tiles to the device and
+        counts the matching pixels with one fused CuPy reduction kernel.
+        """
+        return int(_ndwi_count_kernel(cp.asarray(green), cp.asarray(nir), np.float32(threshold)))
+
+def init_worker(num_threads):
+    """
+    Limits the threads each worker process uses inside the pixel kernels and
+    for GDAL's block decompression, so the process pool and those threads do
+    not oversubscribe the CPU cores.
+    """
+    gdal.SetConfigOption('GDAL_NUM_THREADS', str(num_threads))
+    if numba is not None:
+        numba.set_num_threads(num_threads)
+    else:
+        ne.set_num_threads(num_threads)
+
+def create_process_pool(num_jobs):
+    """
+    Creates the process pool for num_jobs independent image files: up to one
+    worker process per CPU core, each given an equal share of the cores for
+    the multi-threaded kernels through init_worker.
+    """
+    cpus = os.cpu_count() or 1
+    num_workers = max(1, min(cpus, num_jobs))
+    threads_per_worker = max(1, cpus // num_workers)
+    return ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker,
+                               initargs=(threads_per_worker,))
+
+def calculate_water_area(filepath, green_band_num, nir_band_num, threshold, pixel_area, use_gpu=False):
     """
     Calculates the total area of water in a TIF file.
     This version takes a known pixel area as input.
+    Pixels are counted on the GPU with CuPy when use_gpu is True.
     """
-    dataset = gdal.Open(filepath)
-    if dataset is None:
-        return None
+    ndwi_count = _ndwi_count_gpu if use_gpu else _ndwi_count
 
     try:
-        green_array = dataset.GetRasterBand(green_band_num).ReadAsArray().astype(np.float32)
-        nir_array = dataset.GetRasterBand(nir_band_num).ReadAsArray().astype(np.float32)
+        dataset = gdal.Open(filepath)
+        green_band = dataset.GetRasterBand(green_band_num)
+        nir_band = dataset.GetRasterBand(nir_band_num)
 
-        np.seterr(divide='ignore', invalid='ignore')
-        numerator = green_array - nir_array
-        denominator = green_array + nir_array
-        ndwi = np.divide(numerator, denominator, where=(denominator != 0))
-        ndwi[np.isnan(ndwi)] = 0
+        # Keep the bands in their native dtype (usually 16-bit integers): the
+        # kernel widens each pixel itself, so tiles take half the memory
+        dtype = np.result_type(
+            gdal_array.GDALTypeCodeToNumericTypeCode(green_band.DataType),
+            gdal_array.GDALTypeCodeToNumericTypeCode(nir_band.DataType),
+        )
+
+        # Walk the image tile by tile, reading both bands of a tile with a
+        # single call into one reused (band, row, column) buffer
+        tile_x, tile_y = get_tile_size(green_band)
+        buffers = np.empty((2, tile_y, tile_x), dtype=dtype)
+        water_pixel_count = 0
+        for xoff, yoff, xsize, ysize in iter_tiles(green_band, tile_x, tile_y):
+            tile = buffers[:, :ysize, :xsize]
+            dataset.ReadAsArray(xoff, yoff, xsize, ysize, buf_obj=tile, band_list=[green_band_num, nir_band_num])
+            green_array, nir_array = tile
+            water_pixel_count += ndwi_count(green_array, nir_array, threshold)
 
-        water_mask = ndwi > threshold
-        water_pixel_count = np.sum(water_mask)
-        
         total_water_area = water_pixel_count * pixel_area
         return total_water_area
     except Exception as e:
@@ -55,25 +257,77 @@ def calculate_water_area(filepath, green_band_num, nir_band_num, threshold, pixe
     finally:
         dataset = None
 
+# Record layout of the per-image results: the year and the area in square meters
+AREA_RESULT_DTYPE = [('year', 'i4'), ('area', 'f8')]
+
+def get_cache_key(entry):
+    """
+    Returns the key identifying a version of an image file in the area cache:
+    its filename, modification time and size.
+    """
+    stat = entry.stat()
+    return entry.name, stat.st_mtime, stat.st_size
+
+def load_area_cache(cache_path, parameters):
+    """
+    Loads the per-image results saved by a previous run. The cache lives in
+    the image folder and results are only reused for files whose cache key
+    is unchanged; save_area_cache rewrites it with the files of the current
+    run only.
+
+    Args:
+        cache_path (str): Path of the cache file.
+        parameters (tuple): The analysis parameters of this run. Results
+            computed with different parameters are discarded.
+
+    Returns:
+        dict: The cached result of each cache key, or an empty dict.
+    """
+    # The cache is plain JSON rather than a pickle, since loading a pickle
+    # from a possibly shared image folder could run arbitrary code
+    try:
+        with open(cache_path, encoding='utf-8') as cache_file:
+            cache = json.load(cache_file)
+        if cache['parameters'] != list(parameters):
+            return {}
+        return {(name, mtime, size): result for name, mtime, size, result in cache['results']}
+    except (OSError, ValueError, TypeError, KeyError):
+        return {}
+
+def save_area_cache(cache_path, parameters, results):
+    """
+    Saves the per-image results and the parameters they were computed with.
+    """
+    cache = {
+        'parameters': list(parameters),
+        'results': [[*cache_key, result] for cache_key, result in results.items()],
+    }
+    try:
+        with open(cache_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(cache, cache_file)
+    except OSError as e:
+        print(f"  - Warning: Could not save the result cache {cache_path}: {e}")
+
 def plot_area_over_time(time_series_data):
     """
     Creates and displays a line plot of water area over time.
     
     Args:
-        time_series_data (list): A list of tuples, where each tuple is (year, area_in_sq_meters).
+        time_series_data (numpy.ndarray): A structured array of AREA_RESULT_DTYPE
+            records, each holding a year and an area in square meters.
     """
-    if not time_series_data:
+    if len(time_series_data) == 0:
         print("No data to plot.")
         return
 
     # Sort the data by year to ensure the line plot is correct
-    time_series_data.sort()
+    time_series_data.sort(order='year')
     
-    # Unpack the sorted data into separate lists for plotting
-    years, areas_sq_meters = zip(*time_series_data)
+    # Take the sorted columns for plotting
+    years, areas_sq_meters = time_series_data['year'], time_series_data['area']
     
     # Convert area to square kilometers for better readability on the plot
-    areas_sq_km = [area / 1_000_000 for area in areas_sq_meters]
+    areas_sq_km = np.asarray(areas_sq_meters, dtype=np.float64) * 1e-6
     
     # --- Create the Plot ---
     plt.figure(figsize=(12, 7))
@@ -116,10 +370,18 @@ if __name__ == '__main__':
     NDWI_THRESHOLD = 0.2
     
     PIXEL_AREA_SQ_METERS = 900.0
+
+    # Count pixels on the GPU with CuPy instead of the CPU kernels
+    USE_GPU = False
+    if USE_GPU and cp is None:
+        print("Error: USE_GPU is set but CuPy is not installed.")
+        sys.exit(1)
+
+    # Results are reused until any of these parameters changes
+    CACHE_FILENAME = '.water_area_cache.json'
+    CACHE_PARAMETERS = (GREEN_BAND_IN_FILE, NIR_BAND_IN_FILE, NDWI_THRESHOLD, PIXEL_AREA_SQ_METERS)
     
     # --- Main Execution ---
-    # List to store our results as (year, area) tuples
-    time_series_results = []
     
     print(f"Scanning for .tif files in folder: '{image_folder}'...")
     
@@ -128,33 +390,65 @@ if __name__ == '__main__':
         print(f"Error: Folder '{image_folder}' not found. Please create it and add your images.")
         sys.exit(1)
     else:
-        # Loop through every file in the specified folder
-        for filename in sorted(os.listdir(image_folder)):
-            if filename.lower().endswith(('.tif', '.tiff')):
-                print(f"\nProcessing file: {filename}...")
-                
-                # Construct the full path to the image
-                full_path = os.path.join(image_folder, filename)
-                
-                # Extract the year from the filename
-                year = extract_year_from_filename(filename)
-                
-                if year:
-                    # Calculate the water area for the current image
-                    area = calculate_water_area(
-                        filepath=full_path,
-                        green_band_num=GREEN_BAND_IN_FILE,
-                        nir_band_num=NIR_BAND_IN_FILE,
-                        threshold=NDWI_THRESHOLD,
-                        pixel_area=PIXEL_AREA_SQ_METERS
-                    )
-                    
-                    if area is not None:
-                        print(f"  - Found Year: {year}, Calculated Water Area: {area / 1_000_000:,.2f} sq km")
-                        # Add the result to our list
-                        time_series_results.append((year, area))
+        # List the TIF files in the folder
+        entries = [entry for entry in sorted(os.scandir(image_folder), key=lambda entry: entry.name)
+                   if entry.name.lower().endswith(('.tif', '.tiff'))]
+
+        # Extract the years from all filenames at once and collect the
+        # (year, path, cache key) of every file with a year in its name
+        years = extract_years_from_filenames([entry.name for entry in entries])
+        jobs = [(year, entry.path, get_cache_key(entry)) for year, entry in zip(years, entries) if year]
+
+        cache_path = os.path.join(image_folder, CACHE_FILENAME)
+        area_cache = load_area_cache(cache_path, CACHE_PARAMETERS)
+        updated_cache = {}
+
+        # Store our results as (year, area) records, one slot per file
+        time_series_results = np.empty(len(jobs), dtype=AREA_RESULT_DTYPE)
+        result_count = 0
+
+        # Take the results of unchanged files from the cache
+        for year, full_path, cache_key in jobs:
+            if cache_key in area_cache:
+                area = area_cache[cache_key]
+                print(f"\nUsing cached result for file: {os.path.basename(full_path)}")
+                print(f"  - Found Year: {year}, Calculated Water Area: {area / 1_000_000:,.2f} sq km")
+                # Add the result to our array
+                time_series_results[result_count] = (year, area)
+                result_count += 1
+                updated_cache[cache_key] = area
+
+        # Process the uncached files in parallel, one file per task
+        pending_jobs = [job for job in jobs if job[2] not in area_cache]
+        with create_process_pool(len(pending_jobs)) as executor:
+            futures = {}
+            for year, full_path, cache_key in pending_jobs:
+                future = executor.submit(
+                    calculate_water_area,
+                    filepath=full_path,
+                    green_band_num=GREEN_BAND_IN_FILE,
+                    nir_band_num=NIR_BAND_IN_FILE,
+                    threshold=NDWI_THRESHOLD,
+                    pixel_area=PIXEL_AREA_SQ_METERS,
+                    use_gpu=USE_GPU,
+                )
+                futures[future] = (year, full_path, cache_key)
+
+            for future in as_completed(futures):
+                year, full_path, cache_key = futures[future]
+                area = future.result()
+                print(f"\nProcessed file: {os.path.basename(full_path)}")
+
+                if area is not None:
+                    print(f"  - Found Year: {year}, Calculated Water Area: {area / 1_000_000:,.2f} sq km")
+                    # Add the result to our array
+                    time_series_results[result_count] = (year, area)
+                    result_count += 1
+                    updated_cache[cache_key] = area
+
+        save_area_cache(cache_path, CACHE_PARAMETERS, updated_cache)
 
         # --- After processing all files, generate the plot ---
         print("\n--- All files processed. Generating plot... ---")
 
-        plot_area_over_time(time_series_results)
+        plot_area_over_time(time_series_results[:result_count])
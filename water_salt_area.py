@@ -0,0 +1,178 @@
+import numpy as np
+from osgeo import gdal
+import os
+import sys
+from concurrent.futures import as_completed
+
+from water_area import AREA_RESULT_DTYPE, cp, create_process_pool, extract_years_from_filenames, get_tile_size, iter_tiles, _ndwi_count
+from water_area import get_cache_key, load_area_cache, save_area_cache
+from water_area import plot_area_over_time as plot_water_area_over_time
+from salt_area import _sci_count
+from salt_area import plot_area_over_time as plot_salt_area_over_time
+if cp is not None:
+    from water_area import _ndwi_count_gpu
+    from salt_area import _sci_count_gpu
+
+def analyze_image(filepath, water_green_band_num, salt_green_band_num, nir_band_num, red_band_num, swir_band_num,
+                  ndwi_threshold, sci_threshold_min, sci_threshold_max, pixel_area, use_gpu=False):
+    """
+    Calculates both the water and the salt area of a TIF file.
+    Each band is decoded only once per tile and shared by the NDWI and SCI
+    kernels, instead of opening and decompressing the file once per analysis.
+    Pixels are counted on the GPU with CuPy when use_gpu is True.
+
+    Returns:
+        tuple: (water_area, salt_area) in square meters, or None on error.
+    """
+    ndwi_count = _ndwi_count_gpu if use_gpu else _ndwi_count
+    sci_count = _sci_count_gpu if use_gpu else _sci_count
+
+    try:
+        dataset = gdal.Open(filepath)
+
+        # Read every distinct band once, even when both indices use it
+        band_nums = sorted({water_green_band_num, salt_green_band_num, nir_band_num, red_band_num, swir_band_num})
+        first_band = dataset.GetRasterBand(band_nums[0])
+
+        # Walk the image tile by tile, reading all bands of a tile with a
+        # single call into one reused float32 (band, row, column) buffer
+        tile_x, tile_y = get_tile_size(first_band)
+        buffers = np.empty((len(band_nums), tile_y, tile_x), dtype=np.float32)
+        water_pixel_count = 0
+        salt_pixel_count = 0
+        for xoff, yoff, xsize, ysize in iter_tiles(first_band, tile_x, tile_y):
+            tile = buffers[:, :ysize, :xsize]
+            dataset.ReadAsArray(xoff, yoff, xsize, ysize, buf_obj=tile, band_list=band_nums)
+            tiles = dict(zip(band_nums, tile))
+
+            water_pixel_count += ndwi_count(tiles[water_green_band_num], tiles[nir_band_num], ndwi_threshold)
+            salt_pixel_count += sci_count(tiles[salt_green_band_num], tiles[red_band_num], tiles[nir_band_num],
+                                          tiles[swir_band_num], sci_threshold_min, sci_threshold_max)
+
+        return water_pixel_count * pixel_area, salt_pixel_count * pixel_area
+    except Exception as e:
+        print(f"  - Error processing file {os.path.basename(filepath)}: {e}")
+        return None
+    finally:
+        dataset = None
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        # If the number of arguments is wrong, print a helpful message and exit.
+        print("\n--- ERROR: Missing folder path ---")
+        print("Please provide the path to the image folder as a command-line argument.")
+        print(f"Usage: python {sys.argv[0]} <path_to_your_folder>")
+        print(r"Example: python water_salt_area.py E:\Kantubek")
+        sys.exit(1)  # Exit the script with an error code
+    # --- Parameters for your specific data ---
+    # Band numbers used by the NDWI (water) and SCI (salt) indices
+    image_folder = sys.argv[1]
+    WATER_GREEN_BAND_IN_FILE = 2
+    SALT_GREEN_BAND_IN_FILE = 1
+    NIR_BAND_IN_FILE = 4
+    RED_BAND_IN_FILE = 3
+    SWIR_BAND_IN_FILE = 6
+
+    # NDWI threshold for identifying water
+    NDWI_THRESHOLD = 0.2
+
+    # SCI range for identifying salt
+    SCI_THRESHOLD_MIN = 0.04
+    SCI_THRESHOLD_MAX = 0.15
+
+    PIXEL_AREA_SQ_METERS = 900.0
+
+    # Count pixels on the GPU with CuPy instead of the CPU kernels
+    USE_GPU = False
+    if USE_GPU and cp is None:
+        print("Error: USE_GPU is set but CuPy is not installed.")
+        sys.exit(1)
+
+    # Results are reused until any of these parameters changes
+    CACHE_FILENAME = '.water_salt_area_cache.json'
+    CACHE_PARAMETERS = (WATER_GREEN_BAND_IN_FILE, SALT_GREEN_BAND_IN_FILE, NIR_BAND_IN_FILE, RED_BAND_IN_FILE,
+                        SWIR_BAND_IN_FILE, NDWI_THRESHOLD, SCI_THRESHOLD_MIN, SCI_THRESHOLD_MAX, PIXEL_AREA_SQ_METERS)
+
+    # --- Main Execution ---
+
+    print(f"Scanning for .tif files in folder: '{image_folder}'...")
+
+    # Check if the folder exists
+    if not os.path.isdir(image_folder):
+        print(f"Error: Folder '{image_folder}' not found. Please create it and add your images.")
+        sys.exit(1)
+    else:
+        # List the TIF files in the folder
+        entries = [entry for entry in sorted(os.scandir(image_folder), key=lambda entry: entry.name)
+                   if entry.name.lower().endswith(('.tif', '.tiff'))]
+
+        # Extract the years from all filenames at once and collect the
+        # (year, path, cache key) of every file with a year in its name
+        years = extract_years_from_filenames([entry.name for entry in entries])
+        jobs = [(year, entry.path, get_cache_key(entry)) for year, entry in zip(years, entries) if year]
+
+        cache_path = os.path.join(image_folder, CACHE_FILENAME)
+        area_cache = load_area_cache(cache_path, CACHE_PARAMETERS)
+        updated_cache = {}
+
+        # Store our results as (year, area) records, one slot per file
+        water_results = np.empty(len(jobs), dtype=AREA_RESULT_DTYPE)
+        salt_results = np.empty(len(jobs), dtype=AREA_RESULT_DTYPE)
+        result_count = 0
+
+        # Take the results of unchanged files from the cache
+        for year, full_path, cache_key in jobs:
+            if cache_key in area_cache:
+                water_area, salt_area = area_cache[cache_key]
+                print(f"\nUsing cached result for file: {os.path.basename(full_path)}")
+                print(f"  - Found Year: {year}, Calculated Water Area: {water_area / 1_000_000:,.2f} sq km, "
+                      f"Calculated Salt Area: {salt_area / 1_000_000:,.2f} sq km")
+                # Add the results to our arrays
+                water_results[result_count] = (year, water_area)
+                salt_results[result_count] = (year, salt_area)
+                result_count += 1
+                updated_cache[cache_key] = (water_area, salt_area)
+
+        # Process the uncached files in parallel, one file per task
+        pending_jobs = [job for job in jobs if job[2] not in area_cache]
+        with create_process_pool(len(pending_jobs)) as executor:
+            futures = {}
+            for year, full_path, cache_key in pending_jobs:
+                future = executor.submit(
+                    analyze_image,
+                    filepath=full_path,
+                    water_green_band_num=WATER_GREEN_BAND_IN_FILE,
+                    salt_green_band_num=SALT_GREEN_BAND_IN_FILE,
+                    nir_band_num=NIR_BAND_IN_FILE,
+                    red_band_num=RED_BAND_IN_FILE,
+                    swir_band_num=SWIR_BAND_IN_FILE,
+                    ndwi_threshold=NDWI_THRESHOLD,
+                    sci_threshold_min=SCI_THRESHOLD_MIN,
+                    sci_threshold_max=SCI_THRESHOLD_MAX,
+                    pixel_area=PIXEL_AREA_SQ_METERS,
+                    use_gpu=USE_GPU,
+                )
+                futures[future] = (year, full_path, cache_key)
+
+            for future in as_completed(futures):
+                year, full_path, cache_key = futures[future]
+                areas = future.result()
+                print(f"\nProcessed file: {os.path.basename(full_path)}")
+
+                if areas is not None:
+                    water_area, salt_area = areas
+                    print(f"  - Found Year: {year}, Calculated Water Area: {water_area / 1_000_000:,.2f} sq km, "
+                          f"Calculated Salt Area: {salt_area / 1_000_000:,.2f} sq km")
+                    # Add the results to our arrays
+                    water_results[result_count] = (year, water_area)
+                    salt_results[result_count] = (year, salt_area)
+                    result_count += 1
+                    updated_cache[cache_key] = areas
+
+        save_area_cache(cache_path, CACHE_PARAMETERS, updated_cache)
+
+        # --- After processing all files, generate the plots ---
+        print("\n--- All files processed. Generating plots... ---")
+
+        plot_water_area_over_time(water_results[:result_count])
+        plot_salt_area_over_time(salt_results[:result_count])